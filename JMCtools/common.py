@@ -37,26 +37,65 @@ def merge_dicts(*dict_args):
         result.update(dictionary)
     return result
 
+def _is_container(u):
+    """Check whether 'u' is part of a nested data structure (a list, or
+       numpy object array) rather than a 'bottom level' object"""
+    return isinstance(u,list) or (isinstance(u,np.ndarray) and u.dtype==object)
+
+def _flatten_structure(a):
+    """Flatten a nested structure of lists (or numpy object arrays)
+       into a flat list of its 'bottom level' objects, and record the structure
+       as a 'spine' so that it can be put back together later by _rebuild.
+       The spine is ('leaf',) for a bottom level object, and
+       ('list', (child_spines,...)) for a list (or object array).
+       Returns (leaves, spine)
+    """
+    leaves = []
+    def descend(u):
+        if _is_container(u):
+            return ('list', tuple(descend(v) for v in u))
+        else:
+            leaves.append(u)
+            return ('leaf',)
+    spine = descend(a)
+    return leaves, spine
+
+def _rebuild(spine,leaves):
+    """Put a flat sequence of 'bottom level' objects back into the nested
+       structure recorded in 'spine' (as produced by _flatten_structure).
+       The structure is rebuilt out of lists."""
+    leaves = iter(leaves)
+    if spine[0]=='list' and all(child[0]=='leaf' for child in spine[1]):
+        # Shallow structure (the usual case); no need to descend anything
+        return list(leaves)
+    def build(s):
+        if s[0]=='leaf':
+            return next(leaves)
+        else:
+            return [build(child) for child in s[1]]
+    return build(spine)
+
 # Generalisation of the above to any number of arguments
 def apply_f(f,*iters):
     """Apply some function to matching 'bottom level' objects 
-       in mirrored nested structure of lists,
-       return the result in the same nested listed structure.
-       'iters' should be 
+       in mirrored nested structure of lists (or numpy object
+       arrays), return the result in the same nested structure
+       (built out of lists).
+       The structures are flattened once, so 'f' is just applied over
+       a flat list of leaves rather than via recursion through every level.
     """
-    # We have to descend both list structures in lock-step!
-    if all(isinstance(item,list) for item in iters):
-        return list(map(lambda *items: apply_f(f,*items), *iters))
-    elif any(isinstance(item,list) for item in iters):
+    flat = [_flatten_structure(item) for item in iters]
+    spine = flat[0][1]
+    # The nested list structures must match exactly
+    if any(s!=spine for leaves,s in flat[1:]):
         raise ValueError("Inconsistency in nested list structure of arguments detected! Nested structures must be identical in order to apply functions over them")
-    else:
-        return f(*iters)
+    return _rebuild(spine, [f(*items) for items in zip(*[leaves for leaves,s in flat])])
 
 def almost_flatten(A):
     """Flatten array in all except last dimension"""
     return A.reshape((-1,A.shape[-1]))
 
-def get_data_slice(x,i,j=None):
+def get_data_slice(x,i,j=None,structure=None):
     """Extract a single data realisation from 'x', or a numpy 'slice' of realisations
        This harder than it sounds because we don't know what object structure
        we are dealing with. For example the JointModel to which we interface
@@ -74,16 +113,42 @@ def get_data_slice(x,i,j=None):
              first dimension, they should not be some bizarre shape.
              If they are a weird shape they need to be reshaped before this
              function can be applied.
+             A single realisation keeps the sliced dimension (with length 1),
+             so the arrays always match the returned size, and can be passed
+             straight on to e.g. JointDist.logpdf.
+
+       The slice is returned as a nested structure of lists.
+
+       structure - Optional (leaves, spine) pair obtained from
+             _flatten_structure(x[0]). When iterating through many slices of
+             the same data, compute this once and pass it in so that the list
+             structure doesn't need to be descended on every call.
     """
     data, size = x
-    if j==None:
-       data_slice = list(apply_f(lambda A: A[i,...],data))
+    if structure is None:
+       structure = _flatten_structure(data)
+    leaves, spine = structure
+    if j is None:
+       data_slice = _rebuild(spine, [A[i:i+1] for A in leaves]) # Keep the sliced dimension
        slice_length = 1
     else:
-       data_slice = list(apply_f(lambda A: A[i:j,...],data))
+       data_slice = _rebuild(spine, [A[i:j] for A in leaves])
        slice_length = j-i
     return data_slice, tuple([slice_length] + list(size[1:]))
 
+def flatten_data(x):
+    """Convert data 'x' = (data, size) into the layout that get_data_slice
+       handles most efficiently: every bottom level array (which should have
+       shape size + (variates,), like the output of JointDist.rvs) is
+       flattened in all except its last dimension, giving shape
+       (N, variates) with N = prod(size). A slice of realisations is then
+       just a contiguous view of each array.
+       Returns (flat_data, (N,))
+    """
+    data, size = x
+    leaves, spine = _flatten_structure(data)
+    return _rebuild(spine, [almost_flatten(A) for A in leaves]), (int(np.prod(size)),)
+
 def get_data_structure(x):
     """Report the nested structure of a list of lists of numpy arrays"""
     return list(apply_f(lambda A: A.shape, x))
@@ -103,9 +168,7 @@ def split_data(samples,dims):
     #print("dims:", dims)
     # Check dimensions
     if samples.shape[-1] != np.sum(dims):
-        raise ValueError("Dimension mismatch between supplied \
-arguments! 'samples' has last dimension of size {0}, however the sum \
-of the requested slice sizes is {1}! These need to match.".format(samples.shape[-1],np.sum(dims)))
+        _split_mismatch(samples,np.sum(dims))
     for d in dims:
         if d==1:
            #print("slicing: {0}".format(i))
@@ -117,6 +180,37 @@ of the requested slice sizes is {1}! These need to match.".format(samples.shape[
     #print("split samples shapes:",[o.shape for o in out])
     return out
 
+def _split_mismatch(samples,total):
+    raise ValueError("Dimension mismatch between supplied \
+arguments! 'samples' has last dimension of size {0}, however the sum \
+of the requested slice sizes is {1}! These need to match.".format(samples.shape[-1],total))
+
+def make_split_function(dims):
+    """Generate a function which does the same job as split_data for a fixed
+    'dims', but with the slice indices baked into a single expression, so that
+    there is no loop to run on each call. Returns a tuple of views. E.g. for
+    dims = [1,2] we generate
+      def split(samples):
+          if samples.shape[-1] != 3:
+              _split_mismatch(samples, 3)
+          return (samples[...,0], samples[...,1:3], )
+    """
+    items = []
+    i = 0
+    for d in dims:
+        if d==1:
+           items += ["samples[...,{0}]".format(i)]
+        else:
+           items += ["samples[...,{0}:{1}]".format(i,i+d)]
+        i = i+d
+    src = "def split(samples):\n" \
+        + "    if samples.shape[-1] != {0}:\n".format(i) \
+        + "        _split_mismatch(samples, {0})\n".format(i) \
+        + "    return ({0})\n".format("".join(item+", " for item in items))
+    namespace = {'_split_mismatch': _split_mismatch}
+    exec(src, namespace)
+    return namespace['split']
+
 def eCDF(x):
     """Get empirical CDF of some samples"""
     return np.arange(1, len(x)+1)/float(len(x))
@@ -188,10 +282,7 @@ def get_dist_args(dist):
     except AttributeError:
         has_args = False
     if not has_args:
-        try:
-            func_args = get_func_args(dist.logpdf)
-        except AttributeError:
-            func_args = get_func_args(dist.logpmf)
+        func_args = get_func_args(get_logpdf_func(dist))
         # Remove 'x' from this list, we only want the parameter names
         reject_list = ['x','self']
         fargs = [item for item in func_args if item not in reject_list]
@@ -205,6 +296,49 @@ def get_dist_args(dist):
  TransDist constructor.")
     return fargs
 
+def has_logpdf(dist):
+    """Check whether a distribution provides a logpdf (i.e. is continuous), or
+       only a logpmf (i.e. is discrete). Wrapper objects like scipy.stats frozen
+       distributions and TransDist define both methods, so for these we have
+       to inspect the object that they wrap"""
+    for attr in ['orig_dist','dist']:
+        wrapped = getattr(dist,attr,None)
+        if wrapped is not None:
+            return has_logpdf(wrapped)
+    return hasattr(dist,'logpdf')
+
+def get_logpdf_func(dist):
+    """Get the logpdf function of a distribution, or its logpmf if it is discrete
+       (None if it has neither, e.g. if it can only be sampled from)"""
+    if has_logpdf(dist):
+        return dist.logpdf
+    else:
+        return getattr(dist,'logpmf',None)
+
+def params_key(pars):
+    """Convert a dictionary of parameters into a hashable key, for use in caches.
+       numpy arrays are keyed by their contents. Returns None if some
+       parameter value cannot be hashed."""
+    items = []
+    for key in sorted(pars.keys()):
+        val = pars[key]
+        if isinstance(val,np.ndarray):
+            val = (val.dtype.str, val.shape, val.tobytes())
+        try:
+            hash(val)
+        except TypeError:
+            return None
+        items += [(key,val)]
+    return tuple(items)
+
+def data_key(x):
+    """Identify the memory viewed by a data array, for use in caches.
+       Different views of the same memory (e.g. the fresh views produced by
+       split_data on every call) give the same key. The cache must keep a
+       reference to 'x' so that its memory cannot be reused while it is cached."""
+    x = np.asarray(x)
+    return (x.__array_interface__['data'][0], x.shape, x.strides, x.dtype.str)
+
 def search_dicts(key,*dicts):
     """Search multiple dictionaries for a key, returning the first result found
        Priority given to dicts earlier in the argument list"""
@@ -3,22 +3,66 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import scipy.stats as sps
 from scipy.stats import rv_continuous
+from scipy.special import logsumexp
 import scipy.optimize as spo
 from scipy.integrate import quad
 import inspect
+import functools
 import JMCtools.common as c
 import JMCtools.six as six # Python 2 & 3 compatibility tools
 
+# numba is optional; it is only used to speed up some special cases
+try:
+    from numba import njit, prange
+    have_numba = True
+except ImportError:
+    have_numba = False
+
+if have_numba:
+    # fastmath, except for the flags that let LLVM assume there are no
+    # infinities or nans ('ninf', 'nnan'), since those do turn up here
+    @njit(parallel=True, fastmath={'nsz','arcp','contract','afn','reassoc'})
+    def _njit_gmm_logpdf(x, mus, inv_sigmas, consts):
+        """logpdf of a mixture of 1D normal distributions, evaluated at each
+           element of the 1D array 'x'. consts[k] should be
+           log(weight_k) - log(sigma_k) - 0.5*log(2*pi)
+           (zero-weight components should be left out; there must be at
+           least one component)"""
+        out = np.empty_like(x)
+        K = mus.shape[0]
+        for i in prange(x.shape[0]):
+            # logsumexp over components; find the largest term first
+            vmax = consts[0] - 0.5*((x[i]-mus[0])*inv_sigmas[0])**2
+            for k in range(1,K):
+                v = consts[k] - 0.5*((x[i]-mus[k])*inv_sigmas[k])**2
+                if v > vmax:
+                    vmax = v
+            if vmax == -np.inf:
+                # Every term underflows (e.g. x = +-inf); avoid -inf - -inf = nan
+                out[i] = -np.inf
+                continue
+            acc = 0.
+            for k in range(K):
+                v = consts[k] - 0.5*((x[i]-mus[k])*inv_sigmas[k])**2
+                acc += np.exp(v - vmax)
+            out[i] = vmax + np.log(acc)
+        return out
+
+def _no_logpdf(i, submodel, *args, **kwargs):
+    """Stand-in for the logpdf of a submodel which has neither a logpdf nor a logpmf
+       (defined here rather than as a closure so that models can still be pickled)"""
+    raise AttributeError("Submodel {0} ({1}) has neither a 'logpdf' nor a 'logpmf' method, so its pdf cannot be evaluated!".format(i, submodel))
+
 class ListModel:
     """
     Base class for freezable statistics objects (similar to those in scipy.stats)
     that are built from lists of scipy.stats (or similar) objects 
     """
     def __init__(self, submodels, parameters=None, frozen=False):
-        """If parameters!=None, will freeze this model and assume that all submodels are frozen too"""
+        """If parameters is not None, will freeze this model and assume that all submodels are frozen too"""
         self.N_submodels = len(submodels)
         self.parameters = parameters
-        if self.parameters==None or self.parameters==False:
+        if self.parameters is None or self.parameters is False:
             self.frozen = False
         else:
             self.frozen = True
@@ -44,6 +88,19 @@ class ListModel:
                 d = 1
             self.dims += [d]
             self.submodels += [m]
+        # Column of the data array at which the variates of each submodel start
+        self._col_offsets = np.cumsum([0]+self.dims)
+        self._split = c.make_split_function(self.dims)
+        self._freeze_cached = functools.lru_cache(maxsize=1024)(self._freeze_one)
+        # Work out once whether each submodel has a logpdf or a logpmf,
+        # so that we don't need to figure it out on every evaluation
+        # (or, if it has neither, a function that complains when it is called)
+        self._logpdfs = []
+        for i,m in enumerate(self.submodels):
+            f = c.get_logpdf_func(m)
+            if f is None:
+                f = functools.partial(_no_logpdf, i, m)
+            self._logpdfs += [f]
         #print('self.dims:',self.dims)
         #print('self.submodels:',self.submodels)
  
@@ -55,13 +112,13 @@ class ListModel:
            are supposed to be frozen, so we don't store them
            here in that case.
         """
-        if self.frozen and parameters!=None:
+        if self.frozen and parameters is not None:
             raise ValueError("This distribution is frozen! You are not permitted to alter the parameters used to compute the pdf of a frozen distribution object.")
-        elif not self.frozen and parameters==None:
+        elif not self.frozen and parameters is None:
             raise ValueError("This distribution is not frozen, but no parameters were supplied to compute the pdf! Please provide some.")
-        elif self.frozen and parameters==None:
+        elif self.frozen and parameters is None:
             parameters = self.parameters
-        elif not self.frozen and parameters!=None:
+        elif not self.frozen and parameters is not None:
             pass # just use what was passed in 
         # Check that here are we have parameters for all submodels
         # Ok no, that isn't really what this function is for.
@@ -75,20 +132,77 @@ class ListModel:
             raise ValueError("This distribution is already frozen! You cannot re-freeze it with different parameters")
         else:
             out_submodels = []
-            for submodel, pars in zip(self.submodels,parameters):
-                out_submodels += [submodel(**pars)] # Freeze all submodels
+            for i,(submodel, pars) in enumerate(zip(self.submodels,parameters)):
+                # Include the type of each value, so that e.g. 1, 1.0 and True
+                # (which hash equal) don't share a cache entry
+                items = tuple(sorted((key,type(val),val) for key,val in pars.items()))
+                try:
+                    hash(items)
+                except TypeError:
+                    # Can't cache e.g. numpy array parameters, just freeze directly
+                    out_submodels += [submodel(**pars)]
+                    continue
+                out_submodels += [self._freeze_cached(i,items)] # Freeze all submodels
         return out_submodels
 
+    def _freeze_one(self, i, items):
+        """Freeze the ith submodel with parameters given as a tuple of (name, type, value)
+           triples. Called via _freeze_cached, so that repeated freezing with the same
+           parameters (e.g. rejected proposals in an MCMC) re-uses the frozen object"""
+        return self.submodels[i](**{key: val for key,t,val in items})
+
     def split_data(self,samples):
         """Split a numpy array of data into a list of sub-arrays to be passed to independent
         submodel objects.
         Components must be indexed by last dimension of 'samples' array"""
-        return c.split_data(samples,self.dims)
+        return self._split(samples)
+
+    def __getstate__(self):
+        # Generated functions (and the freezing cache) can't be pickled,
+        # so leave them out and re-create them on the other side
+        state = self.__dict__.copy()
+        del state['_split']
+        del state['_freeze_cached']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._split = c.make_split_function(self.dims)
+        self._freeze_cached = functools.lru_cache(maxsize=1024)(self._freeze_one)
 
 # Handy class for sampling from mixture models in scipy.stats
 class MixtureModel(ListModel):
     def __init__(self, submodels, weights=None, *args, **kwargs):
         super().__init__(submodels, weights)
+        # If frozen with ordinary (scalar) weights, store them as arrays
+        # ready for use in the hot loops
+        self._weights = None
+        self._log_weights = None
+        self._probs = None # Sampling probabilities for rvs, computed when first needed
+        if self.frozen and all(np.ndim(w)==0 for w in self.parameters):
+            self._weights = np.asarray(self.parameters, dtype=np.float64)
+            with np.errstate(divide='ignore'):
+                self._log_weights = np.log(self._weights)
+        # Special case: frozen mixture of 1D normal distributions. If numba is
+        # available we can evaluate these with a compiled kernel.
+        self._gmm = None
+        if have_numba and self._weights is not None \
+          and all(getattr(getattr(sm,'dist',None),'name',None)=='norm' for sm in self.submodels):
+            mus    = [sm.mean() for sm in self.submodels] # mean and std are just loc and scale
+            sigmas = [sm.std() for sm in self.submodels]
+            if all(np.ndim(p)==0 for p in mus+sigmas):
+                mus    = np.array(mus, dtype=np.float64)
+                sigmas = np.array(sigmas, dtype=np.float64)
+                keep   = self._weights > 0
+                if keep.sum() > 0: # Kernel needs at least one component
+                    self._gmm = (mus[keep], 1./sigmas[keep],
+                                 self._log_weights[keep] - np.log(sigmas[keep]) - 0.5*np.log(2*np.pi))
+        # Once frozen, the weights and parameters can't change, so swap in
+        # versions of logpdf and rvs (and thus pdf) which don't check them.
+        if self.frozen:
+            self._empty_params = [{} for i in range(len(self.submodels))]
+            self.logpdf = self._logpdf_frozen
+            self.rvs = self._rvs_frozen
 
     def __call__(self, weights=None, parameters=None):
         """Construct a 'frozen' version of the distribution
@@ -101,46 +215,95 @@ class MixtureModel(ListModel):
         frozen_submodels = self._freeze_submodels(parameters)
         return MixtureModel(frozen_submodels, weights) # Copy of this object, but frozen
 
-    def pdf(self, x, weights=None, parameters=None):
-        x = np.array(x)
+    def pdf(self, *args, **kwargs):
+        return np.exp(self.logpdf(*args,**kwargs))
+    
+    def logpdf(self, x, weights=None, parameters=None):
         self._check_parameters(parameters)
         weights = self._check_parameters(weights)
 
-        if weights==None:
+        if weights is None:
             raise ValueError("No mixing weights supplied!")
-        if parameters==None:
+        if parameters is None:
             parameters = [{} for i in range(len(self.submodels))]
-        try:
-            #print("parameters:",parameters)
-            _pdf = weights[0] * np.exp(self.submodels[0].logpdf(x,**parameters[0]))
-        except AttributeError:
-            _pdf = weights[0] * np.exp(self.submodels[0].logpmf(x,**parameters[0]))
-        for w,submodel,pars in zip(weights[1:],self.submodels[1:],parameters[1:]):
-            try:
-                _pdf += w*np.exp(submodel.logpdf(x,**pars))
-            except AttributeError:
-                _pdf += w*np.exp(submodel.logpmf(x,**pars))
-        return _pdf
-    
-    def logpdf(self, *args, **kwargs):
-        return np.log(self.pdf(*args,**kwargs)) # No better way to do this for mixture model
+        return self._logpdf(np.array(x), weights, parameters)
+
+    def _logpdf_frozen(self, x, weights=None, parameters=None):
+        """Version of logpdf used once the distribution is frozen, which skips
+           the parameter validation (unless someone tries to supply some)"""
+        if weights is not None or parameters is not None:
+            return MixtureModel.logpdf(self, x, weights, parameters) # Will raise an error
+        x = np.asarray(x)
+        if self._gmm is not None:
+            return _njit_gmm_logpdf(np.ascontiguousarray(x, dtype=np.float64).ravel(), *self._gmm).reshape(x.shape)
+        elif self._log_weights is not None:
+            logpdfs = np.stack(np.broadcast_arrays(*[f(x) for f in self._logpdfs]))
+            return logsumexp(logpdfs + self._log_weights.reshape((-1,)+(1,)*(logpdfs.ndim-1)), axis=0)
+        return self._logpdf(x, self.parameters, self._empty_params)
+
+    def _logpdf(self, x, weights, parameters):
+        #print("parameters:",parameters)
+        # Do the sum over components in log space, so that components
+        # with very small pdf values don't underflow. Component logpdfs
+        # and weights are broadcast against each other (the weights may
+        # be arrays) and then reduced over the component axis in one go.
+        K = len(self.submodels)
+        terms = np.broadcast_arrays(*([f(x,**pars) for f,pars in zip(self._logpdfs,parameters)]
+                                      + [np.asarray(w) for w in weights]))
+        return logsumexp(np.stack(terms[:K]), b=np.stack(terms[K:]), axis=0)
 
     def rvs(self, size, weights=None, parameters=None):
         #print('MixtureModel.rvs: ', weights, parameters)
         self._check_parameters(parameters)
         weights = self._check_parameters(weights)
-        if weights==None:
+        if weights is None:
             raise ValueError("No mixing weights supplied!")
-        if parameters==None:
+        if parameters is None:
             parameters = [{} for i in range(len(self.submodels))]
-        #print("weights:", weights, ", size:", size)
-        submodel_choices = np.random.choice(range(len(self.submodels)), p=weights, size=size)[...,np.newaxis]
-        submodel_samples = np.array([submodel.rvs(size=size,**pars) for submodel,pars in zip(self.submodels,parameters)])
-
-        #print("submodel_choices.shape:", submodel_choices.shape)
-        #print("submodel_samples.shape:", submodel_samples.shape)
-  
-        _rvs = np.choose(submodel_choices, submodel_samples)
+        return self._rvs(size, self._component_probs(weights), parameters)
+
+    def _rvs_frozen(self, size, weights=None, parameters=None):
+        """Version of rvs used once the distribution is frozen"""
+        if weights is not None or parameters is not None:
+            return MixtureModel.rvs(self, size, weights, parameters) # Will raise an error
+        if self._probs is None:
+            self._probs = self._component_probs(self.parameters) # Only need to do this once
+        return self._rvs(size, self._probs, self._empty_params)
+
+    def _component_probs(self, weights):
+        """Validate mixing weights and convert them to probabilities for choosing
+           submodels. Like np.random.choice, we allow the weights to be off from
+           summing to one by rounding error (np.random.multinomial does not)"""
+        probs = np.asarray(weights, dtype=np.float64)
+        total = probs.sum()
+        if probs.ndim!=1 or np.any(probs<0) or np.abs(total-1) > np.sqrt(np.finfo(np.float64).eps):
+            raise ValueError("Mixing weights must be a list of non-negative numbers which sum to one in order to draw samples! (weights were {0})".format(weights))
+        return probs / total
+
+    def _rvs(self, size, probs, parameters):
+        #print("probs:", probs, ", size:", size)
+        size = tuple(np.atleast_1d(size))
+        N = int(np.prod(size))
+        if N==0:
+            # Nothing to draw, but we still need the trailing shape (and dtype)
+            # of a sample, so ask the first submodel for zero samples
+            empty = self.submodels[0].rvs(size=0,**parameters[0])
+            return empty.reshape(size+empty.shape[1:])
+        # Decide how many samples should come from each submodel, and draw only
+        # those, rather than drawing 'size' samples from every submodel and then
+        # throwing most of them away.
+        counts = np.random.multinomial(N, probs)
+        parts = [submodel.rvs(size=int(n),**pars) for submodel,pars,n in zip(self.submodels,parameters,counts) if n>0]
+        samples = np.empty((N,)+parts[0].shape[1:], dtype=np.result_type(*parts))
+        # Scatter the samples into random positions of the output, so that samples
+        # from different submodels are interleaved. Done with one pass of advanced
+        # indexing rather than copying everything in and then shuffling it.
+        positions = np.random.permutation(N)
+        i = 0
+        for part in parts:
+            samples[positions[i:i+len(part)]] = part
+            i += len(part)
+        _rvs = samples.reshape(size+samples.shape[1:])
         #print("_rvs.shape:",_rvs.shape)
         # # ahh crap, need to apply this in a more fancy way due to possible crazy nested structure of submodel_samples
         # # So, we are choosing elements from the top level list
@@ -164,6 +327,7 @@ class PowerMixtureModel(rv_continuous):
         self.submodels = submodels
         self.weights = weights
         self.norm = 1
+        self._log_norm = 0
         self.domain = domain
         # Need to compute normalisation factor
         # Can do this numerically, but need user to specify the domain to use
@@ -171,6 +335,7 @@ class PowerMixtureModel(rv_continuous):
         # Also only mixtures of 1D models are allowed for now.
         res = quad(self.pdf,*self.domain) # this is a problem if we want to allow parameters to change...
         self.norm = res[0]
+        self._log_norm = np.log(self.norm)
         #print "self.norm = ",self.norm
         
     def pdf(self, *args, **kwargs):
@@ -200,14 +365,18 @@ class PowerMixtureModel(rv_continuous):
         # self.pdf(x, weights, parameters) 
 
     def logpdf(self, x, weights=None, parameters=None):
-        if weights==None:
+        if weights is None:
             weights = self.weights # TODO check if frozen
-        if parameters==None:
+        if parameters is None:
             parameters = [{} for i in range(len(self.submodels))]
-        _logpdf = weights[0] * self.submodels[0].logpdf(x,**parameters[0])
-        for w,submodel,pars in zip(weights[1:],self.submodels[1:],parameters[1:]):
-            _logpdf += w * submodel.logpdf(x,**pars)
-        return _logpdf - np.log(self.norm)
+        logpdfs = np.stack(np.broadcast_arrays(*[submodel.logpdf(x,**pars) for submodel,pars in zip(self.submodels,parameters)]))
+        if all(np.ndim(w)==0 for w in weights):
+            # Weighted sum over submodels in a single pass
+            _logpdf = np.einsum('k,k...->...', np.asarray(weights,dtype=np.float64), logpdfs)
+        else:
+            # Weights are arrays themselves, need to broadcast them against the logpdfs
+            _logpdf = sum(w * l for w,l in zip(weights,logpdfs))
+        return _logpdf - self._log_norm
         
     def rvs(self, size):
         raise ValueError("Sorry, random samples cannot be drawn from this distribution, it is too freaky")
@@ -220,7 +389,15 @@ class JointDist(ListModel):
        Has a feature for overriding the pdf of submodels so that, for example, portions of
        the joint pdf may be profiled or marginalised analytically to speed up fitting routines.
     """
-    def __init__(self, submodels, parameters=None, submodel_logpdf_replacements=None, *args, **kwargs):        
+    def __init__(self, submodels, parameters=None, submodel_logpdf_replacements=None, cache_logpdf=False, *args, **kwargs):        
+        """cache_logpdf - If True, remember the last logpdf computed for each submodel,
+           and re-use it if the submodel is evaluated again with the same parameters
+           on the same data (e.g. when only some blocks of parameters change between
+           calls, as in Gibbs-style fits). Can also be a list of bools to choose this
+           per submodel; caching is not worth it for very cheap submodels.
+           Data is identified by the memory it occupies, so if data arrays are
+           modified in-place then 'invalidate' must be called.
+        """
         # Need some weird stuff for Python 2 and 3 compatibility
         if issubclass(ListModel, object):
             # new style class, call super
@@ -232,10 +409,21 @@ class JointDist(ListModel):
         # Here we DO need to store the submodel parameters, because we sometimes use them to evaluate
         # analytic replacements for the pdfs of the submodels
 
-        if submodel_logpdf_replacements==None:
+        if submodel_logpdf_replacements is None:
             self.submodel_logpdf_replacements = [None for i in range(len(self.submodels))]
         else:
             self.submodel_logpdf_replacements = submodel_logpdf_replacements
+
+        try:
+            self.cache_logpdf = list(cache_logpdf)
+        except TypeError:
+            self.cache_logpdf = [cache_logpdf for i in range(len(self.submodels))]
+        # Cached (parameter key, data key, data, logpdf) for each submodel
+        self._cache = [None for i in range(len(self.submodels))]
+        # Function to evaluate all submodel logpdfs, generated on first use
+        self._logpdf_terms = None
+        # Groups of submodels which can be sampled together in rvs
+        self._rvs_groups, self._rvs_singles = self._group_submodels()
      
 
     def split(self,selection):
@@ -245,13 +433,15 @@ class JointDist(ListModel):
             out = JointDist([(self.submodels[i],self.dims[i]) for i in selection],
                           parameters = [self.parameters[i] for i in selection],
                           frozen = True,
-                          submodel_logpdf_replacements = [self.submodel_logpdf_replacements[i] for i in selection]
+                          submodel_logpdf_replacements = [self.submodel_logpdf_replacements[i] for i in selection],
+                          cache_logpdf = [self.cache_logpdf[i] for i in selection]
                          )
         else:
             # If not frozen, cannot supply parameters
             out = JointDist([(self.submodels[i],self.dims[i]) for i in selection],
                           frozen = False,
-                          submodel_logpdf_replacements = [self.submodel_logpdf_replacements[i] for i in selection]
+                          submodel_logpdf_replacements = [self.submodel_logpdf_replacements[i] for i in selection],
+                          cache_logpdf = [self.cache_logpdf[i] for i in selection]
                          )
         return out
  
@@ -263,7 +453,9 @@ class JointDist(ListModel):
             raise ValueError("This distribution is already frozen! You cannot re-freeze it with different parameters")
         parameters = self._check_parameters(parameters)
         frozen_submodels = self._freeze_submodels(parameters)
-        return JointDist(frozen_submodels, parameters, self.submodel_logpdf_replacements) # Copy of this object, but frozen
+        # Frozen submodels no longer know how many variates they have (e.g. a frozen
+        # multivariate_normal), so pass the dimensions along with them
+        return JointDist(list(zip(frozen_submodels, self.dims)), parameters, self.submodel_logpdf_replacements, cache_logpdf=self.cache_logpdf) # Copy of this object, but frozen
 
     def submodel_logpdf(self,i,x,parameters={}):
         """Call logpdf (or logpmf) of a submodel, automatically detecting where parameters
@@ -275,12 +467,25 @@ class JointDist(ListModel):
         #print("Inspecting submodel[{0}]:".format(i))
         #print(self.submodels[i].__doc__) # Just checking that the correct object is called!
         #print("calling submodels[{0}].logpdf({1},**{2})".format(i,x,parameters))
-        try:
-             _logpdf = self.submodels[i].logpdf(x,**parameters)
-        except AttributeError:
-             _logpdf = self.submodels[i].logpmf(x,**parameters)
+        if self.cache_logpdf[i]:
+            pkey = c.params_key(parameters)
+            xkey = c.data_key(x)
+            cached = self._cache[i]
+            if pkey is not None and cached is not None and cached[0]==pkey and cached[1]==xkey:
+                return cached[3]
+        _logpdf = self._logpdfs[i](x,**parameters)
+        if self.cache_logpdf[i] and pkey is not None:
+            self._cache[i] = (pkey, xkey, x, _logpdf)
         return _logpdf 
 
+    def invalidate(self,i=None):
+        """Discard cached logpdf results for the ith submodel (or all submodels
+           if i is None), e.g. because its data has been modified in-place"""
+        if i is None:
+            self._cache = [None for j in range(len(self.submodels))]
+        else:
+            self._cache[i] = None
+
     def submodel_pdf(self,i,x,parameters=None):
         return np.exp(self.submodel_logpdf(i,x,parameters))
 
@@ -303,39 +508,72 @@ class JointDist(ListModel):
            'frozen' then its corresponding element of 'parameters'
            should be an empty dictionary.
         """
-        # Validate the supplied parameters (if any)
-        parameters = self._check_parameters(parameters)
-        #print("parameters:",parameters) 
-        x_split = self.split_data(x) # Convert data array into list of data for each submodel
-        # Use first submodel to determine pdf array output shape
-        if self.submodel_logpdf_replacements[0]!=None:
-            _pdf = np.exp(self.submodel_logpdf_replacements[0](x_split[0],**parameters[0]))
-        else:
-            _pdf = self.submodel_pdf(0,x_split[0],parameters[0])
-        # Loop over rest of the submodels
-        for i,(xi,submodel,alt_logpdf,pars) in enumerate(zip(x_split[1:],self.submodels[1:],self.submodel_logpdf_replacements[1:],parameters[1:])):
-            #print(pars)
-            if alt_logpdf!=None:
-                _pdf *= np.exp(alt_logpdf(xi,**pars))
-            else:
-                _pdf *= self.submodel_pdf(i+1,xi,pars)
-        return _pdf
+        # Work in log space and exponentiate only once at the end, so that
+        # the product over many submodels doesn't underflow
+        return np.exp(self.logpdf(x,parameters))
     
     def logpdf(self, x, parameters=None):
         """As above but for logpdf
         """
         _logpdf_list = self.logpdf_list(x,parameters)
-        _logpdf = 0
-        for l in _logpdf_list:
-            _logpdf += l
+        # Accumulate into a single output buffer rather than allocating a new
+        # array for every partial sum. Copy the first term, since it might be
+        # a cached result which we must not modify.
+        _logpdf = np.array(_logpdf_list[0], dtype=np.float64)
+        for l in _logpdf_list[1:]:
+            if np.broadcast(_logpdf, l).shape==_logpdf.shape:
+                np.add(_logpdf, l, out=_logpdf) # l fits into the buffer, e.g. shape () or (1,)
+            else:
+                _logpdf = _logpdf + l # output needs to be broadcast to a bigger shape
         return _logpdf
  
+    def logpdf_batch(self, x, parameters):
+        """logpdf for many parameter points at once. 'parameters' is as for
+           logpdf, except that parameter values of univariate submodels may be
+           arrays (broadcastable to a common shape 'param_shape') of parameter
+           points. These are put on new leading axes, so that every submodel
+           logpdf is called only once for all the parameter points, rather than
+           looping over them.
+           Returns an array of shape param_shape + (shape of the logpdf for a
+           single parameter point)
+
+           Limitation: parameters of multivariate submodels (those with more
+           than one variate, e.g. the 'mean' and 'cov' of a multivariate_normal)
+           are naturally array-valued, so they are passed through unchanged and
+           cannot be batched over.
+        """
+        x = np.atleast_2d(x)
+        param_shape = ()
+        for d,pars in zip(self.dims,parameters):
+            if d==1:
+                for val in pars.values():
+                    if np.ndim(val)>0:
+                        param_shape = np.broadcast(np.broadcast_to(0,param_shape),val).shape
+        batch_parameters = []
+        for d,pars in zip(self.dims,parameters):
+            if d==1:
+                # split_data drops the last dimension of the data for univariate submodels
+                newaxes = (Ellipsis,) + (np.newaxis,)*(x.ndim-1)
+                batch_parameters += [{key: np.broadcast_to(val,param_shape)[newaxes] if np.ndim(val)>0 else val
+                                       for key,val in pars.items()}]
+            else:
+                batch_parameters += [pars]
+        return self.logpdf(x,batch_parameters)
+
     def logpdf_list(self, x, parameters=None):
         """list of logpdfs of all submodels
+
+           x should be a numpy array of shape (N_samples, total number of variates),
+           or more generally (..., total number of variates), as produced by rvs,
+           rvs_flat, or get_data_slice. Anything else (e.g. a list, or a single
+           1D data vector) is converted with np.atleast_2d, but that is only meant
+           as a convenience, not for use in tight loops.
         """
         parameters = self._check_parameters(parameters)
        #print("x_in.shape:", x_in.shape)
-        x_split = self.split_data(np.atleast_2d(x)) # Convert data array into list of data for each submodel
+        if getattr(x,'ndim',0) < 2:
+            x = np.atleast_2d(x)
+        x_split = self.split_data(x) # Convert data array into list of data for each submodel
         #for i,x_i in enumerate(x):
         #    #print("x_{0}.shape: {1}".format(i,x_i.shape))
         #    #print("self.dims[{0}]: {1}".format(i,self.dims[i]))
@@ -346,43 +584,93 @@ class JointDist(ListModel):
         #    print(" submodel {0}:".format(i))
         #    for key,val in s.items():
         #        print("  {0}: {1}".format(key,val))
-        # If pdf is frozen, need to 'mute' parameters for submodels whose pdf's have not been replaced by analytic expressions 
-        if parameters == None:
+        if parameters is None:
             parameters = [{} for i in range(len(self.submodels))]
-        if self.frozen:
-            for i in range(len(self.submodels)):
-                if self.submodel_logpdf_replacements[i]==None:
-                    parameters[i] = {}
         #print("JointModel.logpdf: x = ",x)
         #print("JointModel.logpdf: structure(x) = ", c.get_data_structure(x))
         #print("len(self.submodels):",len(self.submodels))
-        # Use first submodel to determine pdf array output shape
-        _logpdf = []
-        if self.submodel_logpdf_replacements[0]!=None:
-            _logpdf += [self.submodel_logpdf_replacements[0](x_split[0],**parameters[0])]
-        else:
-            _logpdf += [self.submodel_logpdf(0,x_split[0],parameters[0])]
-        # Loop over rest of the submodels
-        if len(self.submodels)>1:
-            for i,(xi,submodel,alt_logpdf,pars) in enumerate(zip(x_split[1:],self.submodels[1:],self.submodel_logpdf_replacements[1:],parameters[1:])):
-                #print('submodel:',i+1)
-                #print('pars:',pars)
-                #print('xi:',xi)
-                if alt_logpdf!=None:
-                    _logpdf += [alt_logpdf(xi,**pars)]
-                else:
-                    _logpdf += [self.submodel_logpdf(i+1,xi,pars)]
-        #print("_logpdf.shape:",_logpdf.shape)
-        return _logpdf
+        if self._logpdf_terms is None:
+            self._compile_logpdf_terms()
+        return self._logpdf_terms(x_split,parameters)
+
+    def _compile_logpdf_terms(self):
+        """Generate a function which evaluates the logpdfs of all submodels as
+           one straight-line list of calls, e.g.
+             def _logpdf_terms(_x, _p):
+                 return [_f0(_x[0]), _f1(_x[1], **_p[1])]
+           Which function gets called for each submodel (its logpdf/logpmf, an
+           analytic replacement, or submodel_logpdf if its results are cached),
+           and whether it needs parameters, is then decided once here rather
+           than on every call. If pdf is frozen, parameters are 'muted' for
+           submodels whose pdf's have not been replaced by analytic expressions.
+        """
+        namespace = {}
+        calls = []
+        for i in range(len(self.submodels)):
+            f = "_f{0}".format(i)
+            if self.submodel_logpdf_replacements[i] is not None:
+                namespace[f] = self.submodel_logpdf_replacements[i]
+                call = "{0}(_x[{1}], **_p[{1}])"
+            elif self.cache_logpdf[i]:
+                namespace[f] = functools.partial(self.submodel_logpdf, i)
+                call = "{0}(_x[{1}])" if self.frozen else "{0}(_x[{1}], _p[{1}])"
+            else:
+                namespace[f] = self._logpdfs[i]
+                call = "{0}(_x[{1}])" if self.frozen else "{0}(_x[{1}], **_p[{1}])"
+            calls += [call.format(f,i)]
+        src = "def _logpdf_terms(_x, _p):\n    return [{0}]\n".format(", ".join(calls))
+        exec(src, namespace)
+        self._logpdf_terms = namespace['_logpdf_terms']
+
+    def __getstate__(self):
+        # _logpdf_terms can't be pickled either; it will be re-generated when needed
+        state = super(JointDist, self).__getstate__()
+        state['_logpdf_terms'] = None
+        return state
     
     def set_submodel_logpdf(self, i, f):
         """Replace the logpdf function for the ith submodel"""
         self.submodel_logpdf_replacements[i] = f
+        self._logpdf_terms = None # Needs to be re-generated
 
     def set_logpdf(self, listf):
         """Replace the logpdf for all submodels (use 'None' for elements where
         you want to keep the original pdf"""
         self.submodel_logpdf_replacements = listf
+        self._logpdf_terms = None # Needs to be re-generated
+
+    def _group_submodels(self):
+        """Find groups of frozen scipy.stats submodels from the same family (e.g.
+           many independent Poisson bins), so that rvs can draw samples for a whole
+           group with a single call to the underlying distribution. Returns
+             groups  - list of (columns, dist, args, kwds), where args and kwds hold
+                       arrays of the parameters of each submodel in the group
+             singles - indices of submodels that have to be sampled individually
+        """
+        candidates = {}
+        singles = []
+        for i,(submodel,d) in enumerate(zip(self.submodels,self.dims)):
+            dist = getattr(submodel,'dist',None)
+            name = getattr(dist,'name',None)
+            # Only group the standard scipy.stats distributions (custom ones of the
+            # same type can still differ), with scalar parameters
+            if self.frozen and d==1 and name is not None \
+              and type(getattr(sps,name,None)) is type(dist) \
+              and all(np.ndim(p)==0 for p in list(submodel.args)+list(submodel.kwds.values())):
+                key = (name, len(submodel.args), tuple(sorted(submodel.kwds.keys())))
+                candidates.setdefault(key,[]).append(i)
+            else:
+                singles += [i]
+        groups = []
+        for (name,nargs,kwds_keys),members in candidates.items():
+            if len(members)==1:
+                singles += members
+                continue
+            args = [np.array([self.submodels[i].args[j] for i in members]) for j in range(nargs)]
+            kwds = {k: np.array([self.submodels[i].kwds[k] for i in members]) for k in kwds_keys}
+            columns = np.array([self._col_offsets[i] for i in members])
+            groups += [(columns, getattr(sps,name), args, kwds)]
+        return groups, sorted(singles)
 
     def rvs(self, size, parameters=None):
         """Output will be a list of length N, where N is the number
@@ -394,35 +682,51 @@ class JointDist(ListModel):
             parameters = [{} for i in range(len(self.submodels))]
         else:   
             parameters = self._check_parameters(parameters)
-        _rvs = []
-        for i,(submodel, pars) in enumerate(zip(self.submodels,parameters)):
+        # Want to return this as one array, so that it behaves exactly like scipy.stats objects
+        # and so that it doesn't matter what the underlying objects are, the data feeds through just
+        # the same.
+        # In scipy.multivariate the dimension that indexes the random variable components is the last
+        # one, so the rvs results of each submodel are written into consecutive slices of the last
+        # dimension of one output array (allocated on the first write, see _store_rvs).
+        size = tuple(np.atleast_1d(size))
+        out = None
+        # Groups of similar submodels are sampled all at once
+        for columns, dist, args, kwds in self._rvs_groups:
+            out = self._store_rvs(out, size, columns, dist.rvs(*args, size=size+(len(columns),), **kwds))
+        for i in self._rvs_singles:
+            submodel, pars = self.submodels[i], parameters[i]
+            c0, c1 = self._col_offsets[i], self._col_offsets[i+1]
             try:
                #print("in JointDist.rvs, submodel[{0}], pars={1}".format(i,pars)) 
-               _rvs += [submodel.rvs(size=size,**pars)]
+               _rvs = submodel.rvs(size=size,**pars)
             except TypeError as e:
                # Python 3 only
                #raise TypeError("Encountered error while evaluating submodel.rvs for submodel {0} with parameters {1}.".format(i,list(pars.keys()))) from e
                # Python 2 compatible, but lose traceback
                raise TypeError("Encountered error while evaluating submodel.rvs for submodel {0} with parameters {1}.".format(i,list(pars.keys())))
-
-        # Previously had this. I expanded it out for improved error checking.
-        #_rvs = [submodel.rvs(size=size,**pars) for submodel, pars in zip(self.submodels,parameters)]
-       
-        # NEW: Want to return this as one array, so that it behaves exactly like scipy.stats objects
-        # and so that it doesn't matter what the underlying objects are, the data feeds through just
-        # the same.
-        # In scipy.multivariate the dimension that indexes the random variable components is the last
-        # one, so we need to stack the rvs results along the last dimension.
-
-        #print("Shapes:") 
-        #for X in _rvs:
-        #    print(X.shape)
-        size = np.atleast_1d(size)
-        newsize = tuple(list(size) + [-1])
-        out = np.concatenate([a.reshape(*newsize) for a in _rvs],axis=-1) #Make sure number of dimensions is correct
+            out = self._store_rvs(out, size, slice(c0,c1), _rvs.reshape(size + (c1-c0,))) #Make sure number of dimensions is correct
+        if out is None:
+            out = np.empty(size + (0,)) # No submodels
         #print("out.shape:", out.shape)
         return out
 
+    def _store_rvs(self, out, size, columns, samples):
+        """Write samples into the given columns of the rvs output array, allocating
+           the array on first use. Its dtype is promoted as needed, the same way
+           np.concatenate would, so e.g. purely discrete models give integer samples"""
+        if out is None:
+            out = np.empty(size + (self._col_offsets[-1],), dtype=samples.dtype)
+        elif np.result_type(out.dtype, samples.dtype) != out.dtype:
+            out = out.astype(np.result_type(out.dtype, samples.dtype))
+        out[...,columns] = samples
+        return out
+
+    def rvs_flat(self, size, parameters=None):
+        """As rvs, but with all the 'size' dimensions flattened into one, so
+        the output has shape (prod(size), total number of variates). Blocks of
+        consecutive samples are then contiguous views of the output."""
+        return self.rvs(size, parameters).reshape((-1, self._col_offsets[-1]))
+
 class TransDist:
     """Transform a probability distribution into a different parameterisation
        Todo: implement frozen-ness
@@ -487,6 +791,38 @@ class TransDist:
     func_args      = {3}\n\
 ".format(orig_dist,transform_func,renaming_map,func_args))
         #print("self.args:", self.args)
+        self._compile_orig_args()
+
+    def _compile_orig_args(self):
+        """Replace get_orig_args with a function specialised to our renaming map,
+           so that the renaming doesn't need to be worked out on every call.
+           E.g. for renaming_map ['a -> b'] we generate
+             def get_orig_args(**_kw):
+                 if 'a' in _kw: _kw['b'] = _kw.pop('a')
+                 return _transform_func(**_kw)
+           Only parameters that are actually supplied get renamed, so parameters
+           can still be left out if transform_func has defaults for them.
+        """
+        renames = sorted(self.renaming_map.items())
+        if any(val in self.renaming_map for key,val in renames):
+            return # Chained/swapped renamings; renaming in sequence would mix them up, so stick with the generic version
+        src = "def get_orig_args(**_kw):\n" \
+            + "".join("    if {0!r} in _kw: _kw[{1!r}] = _kw.pop({0!r})\n".format(key,val) for key,val in renames) \
+            + "    return _transform_func(**_kw)\n"
+        namespace = {'_transform_func': self.transform_func}
+        exec(src, namespace)
+        self.get_orig_args = namespace['get_orig_args']
+
+    def __getstate__(self):
+        # Generated functions can't be pickled, so leave it out and rebuild it
+        # on the other side (needed e.g. for ParameterModel.find_MLE_parallel)
+        state = self.__dict__.copy()
+        state.pop('get_orig_args', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_orig_args()
 
     def rvs(self, size, **parameters):
         """Generate random samples from the distribution"""
@@ -499,7 +835,9 @@ class TransDist:
     
     def get_orig_args(self,**parameters):
         """Compute parameters for the original distribution using the
-           reparameterisation"""
+           reparameterisation.
+           (Generic version; normally replaced by a specialised version
+           in the constructor, see _compile_orig_args)"""
         # Need to take into account possible renaming:
         renamed_parameters = {}
         for key, val in parameters.items():
@@ -82,9 +82,9 @@ class Block:
     def fromBlock(cls,block,jointmodel=None,submodel_deps=None):
        deps = block.deps
        submodels = block.submodels
-       if (block.jointmodel!=None) and (jointmodel!=None):
+       if (block.jointmodel is not None) and (jointmodel is not None):
           raise ValueError("Tried to set 'jointmodel' for a copy of a Block that already has a 'jointmodel' set!")
-       if block.jointmodel!=None:
+       if block.jointmodel is not None:
           jointmodel = block.jointmodel
        return cls(deps,submodels,jointmodel,submodel_deps)
 
@@ -271,7 +271,7 @@ class ParameterModel:
             self.submodel_deps += [func_args] 
         #print('self.submodel_deps:', self.submodel_deps)
  
-        if x==None:
+        if x is None:
            self.x = [None for i in range(self.model.N_submodels)]
         else:
            self.validate_data(x)
@@ -410,7 +410,7 @@ class ParameterModel:
            in the ParameterModel class.
         """
         #print(null_parameters)
-        if null_parameters!=None:
+        if null_parameters is not None:
            args = self.get_pdf_args(null_parameters)
         else:
            args = {}
@@ -535,7 +535,7 @@ class ParameterModel:
                 if words[0]=="fix" and val==True:
                     fixed += [words[1]]
 
-            if seeds!=None:
+            if seeds is not None:
                 def seed(i):
                     out = {}
                     for p,val in seeds.items():
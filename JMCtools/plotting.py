@@ -44,7 +44,7 @@ def plot_teststat(ax, tobin, theoryf, log=True, label="", c='r', obs=None, pval=
         ax.set_yscale("log")     
     if obs is not None:
         # Draw line for observed value, and show p-value region shaded
-        if theoryf!=None:
+        if theoryf is not None:
            if reverse_fill:
               # Sometimes p-value is computed using the other tail of the distribution.
               qfill = np.arange(obs,ran[1],0.01)
@@ -0,0 +1,58 @@
+"""Check the nested data structure helpers in JMCtools.common"""
+
+# Some trickery for relative imports, see: https://stackoverflow.com/a/27876800
+if __name__ == '__main__':
+    if __package__ is None:
+        import sys
+        import os
+        sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        import JMCtools as jt
+        import JMCtools.common as c
+    else:
+        import JMCtools as jt
+        import JMCtools.common as c
+
+import numpy as np
+
+A = np.arange(6).reshape(2,3)
+B = np.arange(4).reshape(4,1)
+C = np.arange(8).reshape(4,2)
+
+# Nested lists; results are rebuilt out of lists, so shapes can't be confused with nesting
+print(c.get_data_structure([A,[B,C]]))
+assert c.get_data_structure([A,[B,C]]) == [(2,3), [(4,1),(4,2)]]
+out = c.apply_f(lambda X,Y: X+Y, [A,[B,C]], [A,[B,C]])
+assert np.all(out[0]==2*A) and np.all(out[1][0]==2*B) and np.all(out[1][1]==2*C)
+
+# Tuples are bottom level objects, not containers
+assert c.apply_f(len, [(1,2),(3,4,5)]) == [2,3]
+
+# Numpy object arrays are containers, just like lists (fill them element by
+# element, since np.array([B,C],dtype=object) would try to merge the arrays)
+obj = np.empty(2, dtype=object)
+obj[0] = B
+obj[1] = C
+assert c.get_data_structure([A,obj]) == [(2,3), [(4,1),(4,2)]]
+out = c.apply_f(lambda X: 10*X, obj)
+assert isinstance(out,list) and np.all(out[0]==10*B) and np.all(out[1]==10*C)
+# Mismatched nesting is still detected
+try:
+    c.apply_f(lambda X,Y: X+Y, [B,C], [B,[C]])
+except ValueError:
+    pass
+else:
+    raise AssertionError("Expected a ValueError for mismatched structures")
+
+# Slicing data stored in an object array, with and without a precomputed structure
+data = ([B,obj], (4,))
+structure = c._flatten_structure(data[0])
+for s in [None, structure]:
+    single, size = c.get_data_slice(data,2,structure=s)
+    assert size == (1,)
+    assert np.all(single[0]==B[2:3]) and np.all(single[1][1]==C[2:3])
+    block, size = c.get_data_slice(data,1,3,structure=s)
+    assert size == (2,)
+    assert np.all(block[0]==B[1:3]) and np.all(block[1][0]==B[1:3]) and np.all(block[1][1]==C[1:3])
+
+print("All data structure checks passed")
@@ -0,0 +1,42 @@
+"""Check that a JointDist containing a multivariate submodel still works after freezing"""
+
+# Some trickery for relative imports, see: https://stackoverflow.com/a/27876800
+if __name__ == '__main__':
+    if __package__ is None:
+        import sys
+        import os
+        sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+    else:
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+
+import scipy.stats as sps
+import numpy as np
+
+mvn_pars = {'mean':[0,0],'cov':[[1,0.5],[0.5,2]]}
+norm_pars = {'loc':1,'scale':2}
+joint = jtd.JointDist([(sps.multivariate_normal,2), sps.norm])
+frozen = joint([mvn_pars,norm_pars])
+
+# The frozen copy has to remember how many variates each submodel has
+print("frozen.dims:", frozen.dims)
+assert frozen.dims == [2,1]
+
+x = frozen.rvs((3,))
+print("frozen.rvs((3,)).shape:", x.shape)
+assert x.shape == (3,3)
+assert frozen.rvs((4,5)).shape == (4,5,3)
+assert frozen.rvs_flat((4,5)).shape == (20,3)
+
+# Frozen and unfrozen logpdfs agree, and match the submodels evaluated directly
+expected = sps.multivariate_normal(**mvn_pars).logpdf(x[...,0:2]) + sps.norm(**norm_pars).logpdf(x[...,2])
+assert np.allclose(frozen.logpdf(x), expected)
+assert np.allclose(joint.logpdf(x,[mvn_pars,norm_pars]), expected)
+
+# Splitting the frozen copy keeps the dimensions too
+assert frozen.split([0]).rvs((3,)).shape == (3,2)
+
+print("All frozen multivariate JointDist checks passed")
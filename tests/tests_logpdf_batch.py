@@ -0,0 +1,42 @@
+"""Check that JointDist.logpdf_batch agrees with looping logpdf over parameter points"""
+
+# Some trickery for relative imports, see: https://stackoverflow.com/a/27876800
+if __name__ == '__main__':
+    if __package__ is None:
+        import sys
+        import os
+        sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+    else:
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+ 
+import scipy.stats as sps
+import numpy as np
+
+# Univariate submodels, batched over a 2D grid of parameter points
+joint = jtd.JointDist([sps.norm,sps.poisson])
+x = joint.rvs((10,),[{'loc':1,'scale':2},{'mu':5}])
+locs, mus = np.meshgrid(np.linspace(-1,3,4), np.linspace(2,8,5), indexing='ij')
+
+batch = joint.logpdf_batch(x,[{'loc':locs,'scale':2},{'mu':mus}])
+print("logpdf_batch output shape:", batch.shape)
+assert batch.shape == locs.shape + (10,)
+for i in range(locs.shape[0]):
+    for j in range(locs.shape[1]):
+        single = joint.logpdf(x,[{'loc':locs[i,j],'scale':2},{'mu':mus[i,j]}])
+        assert np.allclose(batch[i,j], single)
+
+# Multivariate submodel with (vector-valued) parameters left unbatched
+joint2 = jtd.JointDist([sps.norm,(sps.multivariate_normal,2)])
+mvn_pars = {'mean':[0,0],'cov':[[1,0.5],[0.5,2]]}
+x2 = joint2.rvs((10,),[{'loc':0,'scale':1},mvn_pars])
+scales = np.linspace(0.5,3,6)
+batch2 = joint2.logpdf_batch(x2,[{'loc':0,'scale':scales},mvn_pars])
+assert batch2.shape == (6,10)
+for i,scale in enumerate(scales):
+    assert np.allclose(batch2[i], joint2.logpdf(x2,[{'loc':0,'scale':scale},mvn_pars]))
+
+print("All logpdf_batch checks passed")
@@ -0,0 +1,73 @@
+"""Check the optional caching of submodel logpdfs in JointDist"""
+
+# Some trickery for relative imports, see: https://stackoverflow.com/a/27876800
+if __name__ == '__main__':
+    if __package__ is None:
+        import sys
+        import os
+        sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+    else:
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+
+import scipy.stats as sps
+import numpy as np
+
+pars = [{'loc':1,'scale':2},{'mu':5}]
+joint = jtd.JointDist([sps.norm,sps.poisson], cache_logpdf=True)
+x = joint.rvs((10,),pars)
+
+def expected(x,pars):
+    return [sps.norm.logpdf(x[...,0],**pars[0]), sps.poisson.logpmf(x[...,1],**pars[1])]
+
+# Same data and parameters: the cached arrays themselves come back
+first = joint.logpdf_list(x,pars)
+second = joint.logpdf_list(x,pars)
+assert all(a is b for a,b in zip(first,second))
+assert all(np.allclose(a,b) for a,b in zip(first,expected(x,pars)))
+# logpdf must not modify the cached results when summing them
+assert np.allclose(joint.logpdf(x,pars), sum(expected(x,pars)))
+assert np.allclose(joint.logpdf(x,pars), sum(expected(x,pars)))
+
+# Different parameters: recomputed
+pars2 = [{'loc':0,'scale':1},{'mu':3}]
+third = joint.logpdf_list(x,pars2)
+assert all(a is not b for a,b in zip(second,third))
+assert all(np.allclose(a,b) for a,b in zip(third,expected(x,pars2)))
+
+# The cache is keyed on the memory holding the data, so editing the data
+# in-place gives stale results until the cache is invalidated
+before = joint.logpdf_list(x,pars2)[0]
+x[0,0] = 100
+stale = joint.logpdf_list(x,pars2)[0]
+assert stale is before
+assert not np.allclose(stale, expected(x,pars2)[0])
+joint.invalidate(0)
+assert np.allclose(joint.logpdf_list(x,pars2)[0], expected(x,pars2)[0])
+x[0,1] = x[0,1] + 1
+joint.invalidate() # All submodels
+assert all(np.allclose(a,b) for a,b in zip(joint.logpdf_list(x,pars2),expected(x,pars2)))
+
+# Caching only some of the submodels
+joint2 = jtd.JointDist([sps.norm,sps.poisson], cache_logpdf=[True,False])
+first = joint2.logpdf_list(x,pars)
+second = joint2.logpdf_list(x,pars)
+assert first[0] is second[0]
+assert first[1] is not second[1]
+assert all(np.allclose(a,b) for a,b in zip(second,expected(x,pars)))
+
+# The flags carry over to frozen and split copies
+frozen = joint2(pars)
+assert frozen.cache_logpdf == [True,False]
+first = frozen.logpdf_list(x)
+second = frozen.logpdf_list(x)
+assert first[0] is second[0]
+assert first[1] is not second[1]
+assert all(np.allclose(a,b) for a,b in zip(second,expected(x,pars)))
+assert joint2.split([1,0]).cache_logpdf == [False,True]
+assert frozen.split([1,0]).cache_logpdf == [False,True]
+
+print("All logpdf caching checks passed")
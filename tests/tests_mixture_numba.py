@@ -0,0 +1,60 @@
+"""Compare the numba-compiled logpdf of frozen mixtures of 1D normals against
+   an explicit logsumexp over the component logpdfs"""
+
+import sys
+
+# Some trickery for relative imports, see: https://stackoverflow.com/a/27876800
+if __name__ == '__main__':
+    if __package__ is None:
+        import os
+        sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+    else:
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+ 
+import scipy.stats as sps
+from scipy.special import logsumexp
+import numpy as np
+
+if not jtd.have_numba:
+    print("numba is not installed, so there is nothing to compare")
+    sys.exit(0)
+
+mix = jtd.MixtureModel([sps.norm,sps.norm,sps.norm])
+weights = [0.2,0.5,0.3]
+pars = [{'loc':-3,'scale':1},{'loc':0,'scale':2},{'loc':4,'scale':0.5}]
+frozen = mix(weights,pars)
+assert frozen._gmm is not None
+
+def general_logpdf(x, weights=weights):
+    """The mixture logpdf computed directly from the component logpdfs"""
+    terms = np.stack([sps.norm.logpdf(x,**p) for p in pars])
+    w = np.array(weights,dtype=float).reshape((-1,)+(1,)*np.ndim(x))
+    return logsumexp(terms, b=w, axis=0)
+
+# Ordinary values, plus the edge cases where every component underflows
+x = np.concatenate([np.linspace(-20,20,1001), [np.inf, -np.inf, 1e200, -1e200]])
+fast = frozen.logpdf(x)
+slow = general_logpdf(x)
+print("max difference (finite x):", np.max(np.abs(fast[:1001]-slow[:1001])))
+print("edge cases (numba):      ", fast[1001:])
+print("edge cases (logsumexp):  ", slow[1001:])
+assert np.allclose(fast[:1001], slow[:1001])
+assert np.all(fast[1001:] == -np.inf) and np.all(slow[1001:] == -np.inf)
+
+# Shape of the input should be preserved
+X = np.linspace(-5,5,12).reshape(3,4)
+assert frozen.logpdf(X).shape == (3,4)
+assert np.allclose(frozen.logpdf(X), general_logpdf(X))
+
+# Zero-weight components are left out of the kernel
+frozen0 = mix([0,1,0],pars)
+assert np.allclose(frozen0.logpdf(x[:1001]), sps.norm(loc=0,scale=2).logpdf(x[:1001]))
+
+# If all weights are zero the kernel cannot be used at all
+frozenz = mix([0,0,0],pars)
+assert frozenz._gmm is None
+print("All numba mixture checks passed")
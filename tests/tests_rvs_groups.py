@@ -0,0 +1,70 @@
+"""Check that JointDist.rvs samples groups of similar frozen submodels correctly"""
+
+# Some trickery for relative imports, see: https://stackoverflow.com/a/27876800
+if __name__ == '__main__':
+    if __package__ is None:
+        import sys
+        import os
+        sys.path.append( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+        sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+    else:
+        import JMCtools as jt
+        import JMCtools.distributions as jtd
+
+import scipy.stats as sps
+import numpy as np
+
+np.random.seed(1234)
+
+# Mixed families, with a multivariate submodel shifting the later columns along
+joint = jtd.JointDist([sps.norm, sps.poisson, (sps.multivariate_normal,2), sps.norm, sps.expon, sps.poisson])
+pars = [{'loc':1,'scale':2},
+        {'mu':5},
+        {'mean':[0,10],'cov':[[1,0],[0,4]]},
+        {'loc':-3,'scale':0.5},
+        {'scale':2},
+        {'mu':20}]
+frozen = joint(pars)
+
+# Unfrozen models don't know their parameters in advance, so nothing is grouped
+assert joint._rvs_groups == [] and joint._rvs_singles == list(range(6))
+
+# The norms and the poissons are grouped; the multivariate_normal and the lone expon are not
+groups = {dist.name: (list(columns),args,kwds) for columns,dist,args,kwds in frozen._rvs_groups}
+print("groups:", {name: g[0] for name,g in groups.items()}, "singles:", frozen._rvs_singles)
+assert sorted(groups.keys()) == ['norm','poisson']
+assert groups['norm'][0] == [0,4] and groups['poisson'][0] == [1,6]
+assert np.all(groups['norm'][2]['loc'] == [1,-3]) and np.all(groups['norm'][2]['scale'] == [2,0.5])
+assert np.all(groups['poisson'][2]['mu'] == [5,20])
+assert frozen._rvs_singles == [2,4]
+
+# Submodels frozen with positional parameters don't group with keyword ones
+mixed = jtd.JointDist([sps.norm(1,2), sps.norm(loc=1,scale=2), sps.norm(3,1)], frozen=True)
+assert [list(g[0]) for g in mixed._rvs_groups] == [[0,2]]
+assert np.all(mixed._rvs_groups[0][2][0] == [1,3]) and np.all(mixed._rvs_groups[0][2][1] == [2,1])
+assert mixed._rvs_singles == [1]
+
+# Output dtype: integer when everything is discrete, float otherwise
+counts = jtd.JointDist([sps.poisson,sps.poisson,sps.poisson])([{'mu':1},{'mu':2},{'mu':3}])
+assert len(counts._rvs_groups) == 1 and counts._rvs_singles == []
+assert np.issubdtype(counts.rvs((5,)).dtype, np.integer)
+x = frozen.rvs((200000,))
+assert x.shape == (200000,7)
+assert np.issubdtype(x.dtype, np.floating)
+
+# Per-column sample moments
+means = [1, 5, 0, 10, -3, 2, 20]
+stds  = [2, np.sqrt(5), 1, 2, 0.5, 2, np.sqrt(20)]
+print("sample means:", np.mean(x,axis=0))
+print("sample stds: ", np.std(x,axis=0))
+assert np.allclose(np.mean(x,axis=0), means, atol=0.05)
+assert np.allclose(np.std(x,axis=0), stds, atol=0.05)
+
+# Grouped and individual sampling agree in distribution
+xm = mixed.rvs((200000,))
+assert np.allclose(np.mean(xm,axis=0), [1,1,3], atol=0.05)
+assert np.allclose(np.std(xm,axis=0), [2,2,1], atol=0.05)
+
+print("All rvs grouping checks passed")